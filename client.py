@@ -1,10 +1,16 @@
 import socket
 import asyncio
 import logging
+import msgpack
 import socketio
+import functools
 import threading
 
-from server import Server
+from collections import defaultdict
+
+from server import Server, JSON_SERIALIZER
+
+logger = logging.getLogger(__name__)
 
 
 class Network:
@@ -24,20 +30,23 @@ class Network:
 
     BROADCAST_PORT = Server.BROADCAST_PORT    # Port for listening to server broadcasts
     SERVER_BROADCAST = Server.BROADCAST_MESSAGE # Broadcast message format
+    _BROADCAST_PREFIX = SERVER_BROADCAST.encode('utf-8')    # Prefix to match against raw datagrams
+    _PREFIX_LEN = len(SERVER_BROADCAST) + 1     # Offset of the port in a broadcast message
     CLIENT_DISCOVER_TIMEOUT = 20                # Timeout for server discovery
     CLIENT_DISCOVER_DELAY = 2                   # Delay between server discovery attempts
     IS_DISCOVERING = False                      # Flag to enable server discovery
 
-    broadcast_servers = []  # List of servers found during discovery
-    potential_servers = []  # List of servers that can be connected to
-
 
     def __init__(self, server_host, server_port):
         self.server_host = server_host
         self.server_port = server_port
+        self.broadcast_servers = []  # List of servers found during discovery
+        self.potential_servers = []  # List of servers that can be connected to
+        self._seen_hosts = set()
+        self._client_pool = {}       # Pooled probe clients, keyed by (host, port)
         self.shutdown_flag = threading.Event()
-        self.sio = socketio.AsyncClient()
-        self.event_manager = NetworkEventManager()
+        self.sio = socketio.AsyncClient(json=JSON_SERIALIZER)
+        self.event_manager = NetworkEventManager(self.sio)
         self.loop = asyncio.get_running_loop()
         self.register_event_handlers()
 
@@ -50,36 +59,61 @@ class Network:
 
     async def discover_servers(self):
         """Listens for broadcast messages from servers on the local network."""
-        def listen():
-            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                sock.bind(('', self.BROADCAST_PORT)) 
-                for i in range(self.CLIENT_DISCOVER_TIMEOUT):
-                    sock.settimeout(1.0)
-                    try:
-                        data, addr = sock.recvfrom(1024)
-                        data = data.decode('utf-8')
-                        if data[:18] == self.SERVER_BROADCAST and all(server["host"] != addr[0] for server in self.broadcast_servers):
-                            self.broadcast_servers.append({"host": addr[0], "port": data[len(self.SERVER_BROADCAST) + 1:]})
-                        logging.debug(f"[Net-Discover] Received broadcast from {addr}")
-                    except socket.timeout:
-                        logging.debug(f"[Net-Discover] Listening for broadcasts...")
-                        continue
-        self.listen_thread = threading.Thread(name="GameThread-1) (Broadcast", target=listen, daemon=True)
-        self.listen_thread.start()
-        self.listen_thread.join()    
-        logging.debug("[Net-Discover] Server discovery stopped")
-        logging.debug(f"[Net-Discover] Found {self.broadcast_servers}") 
-
-        for server in self.broadcast_servers:
-            if await self.connect(server["host"], server["port"]):
-                await self.sio.emit(self.SERVER_DISCOVER, server["host"])
-                await asyncio.sleep(self.CLIENT_DISCOVER_DELAY)
-                await self.sio.disconnect()
-            else:
-                logging.error(f"Failed to connect to {server['host']}:{server['port']}")
-
-        self.DISCOVER_ON = False
+        try:
+            transport, protocol = await self.loop.create_datagram_endpoint(
+                lambda: _DiscoverProtocol(self),
+                local_addr=('0.0.0.0', self.BROADCAST_PORT),
+                reuse_port=True
+            )
+            await asyncio.sleep(self.CLIENT_DISCOVER_TIMEOUT)
+            transport.close()
+            logger.debug("[Net-Discover] Server discovery stopped")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[Net-Discover] Found %s", self.broadcast_servers)
+
+            await asyncio.gather(*(self._probe(server) for server in self.broadcast_servers), return_exceptions=True)
+        finally:
+            self.DISCOVER_ON = False
+
+
+    async def _on_discover(self, data):
+        """Handles server discovery messages."""
+        logger.info("[Net-Discover] %s", data)
+        if data["connectable"] == True:
+            try:
+                self.potential_servers.append({
+                    "player_count": data["player_count"],
+                    "session_name": data["session_name"],
+                    "session_host": data["session_host"],
+                    "session_port": data["session_port"]
+                })
+                logger.info("[Net-Discover] Success on %s", data['session_port'])
+            except KeyError as e:
+                logger.error("[Net-Discover] Missing data %s", e)
+        else:
+            logger.info("[Net-Discover] Failure on %s", data['session_port'])
+
+
+    async def _get_client(self, host, port):
+        """Returns a pooled socket.io client for the server, connecting on first use."""
+        key = (host, port)
+        sio = self._client_pool.get(key)
+        if sio is None or not sio.connected:
+            sio = socketio.AsyncClient(reconnection=True, json=JSON_SERIALIZER)
+            sio.on(self.SERVER_DISCOVER, self._on_discover)
+            await sio.connect(f'http://{host}:{port}?mode=probe')
+            self._client_pool[key] = sio
+        return sio
+
+
+    async def _probe(self, server):
+        """Probes a discovered server for its session details over a pooled connection."""
+        try:
+            sio = await self._get_client(server["host"], server["port"])
+            await sio.emit(self.SERVER_DISCOVER, server["host"])
+            await asyncio.sleep(self.CLIENT_DISCOVER_DELAY)
+        except Exception as e:
+            logger.error("Failed to connect to %s:%s (%s)", server['host'], server['port'], e)
 
 
     def register_event_handlers(self):
@@ -87,86 +121,88 @@ class Network:
         @self.sio.on(self.SERVER_INFO)
         async def info(data):
             """Handles server information messages."""
-            logging.info(f'{data}')
+            logger.info('%s', data)
 
         @self.sio.on(self.SERVER_WARNING)
         async def warning(data):
             """Handles server warning messages."""
-            logging.warning(f'{data}')
-
-        @self.sio.on(self.SERVER_DISCOVER)
-        async def discover(data):
-            """Handles server discovery messages."""
-            logging.info(f"[Net-Discover] {data}")
-            if data["connectable"] == True:
-                try:
-                    self.potential_servers.append({
-                        "player_count": data["player_count"], 
-                        "session_name": data["session_name"],
-                        "session_host": data["session_host"],
-                        "session_port": data["session_port"]
-                    })
-                    logging.info(f"[Net-Discover] Success on {data['session_port']}")
-                except KeyError as e:
-                    logging.error(f"[Net-Discover] Missing data {e}")
-            else:
-                logging.info(f"[Net-Discover] Failure on {data['session_port']}")
-
-        @self.sio.on('*')
-        async def any_event(event, data):
-            """Handles any event and triggers the corresponding event."""
-            logging.info(f"[Net-Any] ({event}): {data}")
-            await self.event_manager.trigger_event(event, data)
+            logger.warning('%s', data)
+
+        self.sio.on(self.SERVER_DISCOVER, self._on_discover)
 
 
     async def connect(self, server_host, server_port):
         """Attempts to connect to the server and returns the success status."""
         host = server_host if server_host else self.server_host
         port = server_port if server_port else self.server_port
+        probe = self._client_pool.pop((host, str(port)), None)
+        if probe is not None and probe.connected:
+            await probe.disconnect()
         try:
             await self.sio.connect(f'http://{host}:{port}')
             return True
         except Exception as e:
-            logging.error(f'[Net-Connect] Fehler: {e}')
+            logger.error('[Net-Connect] Fehler: %s', e)
             return False
 
 
     async def disconnect(self):
+           for sio in self._client_pool.values():
+               if sio.connected:
+                   await sio.disconnect()
+           self._client_pool.clear()
            await self.sio.disconnect()
-           logging.info("[Net-Disconnect] Disconnected")
+           logger.info("[Net-Disconnect] Disconnected")
 
 
     async def send_data(self, event, data):
         """Sends a packet with a specific type and data to the server"""
         try:
-            await self.sio.emit(self.SERVER_PACKET, {"event_type": event, "data": data})
+            await self.sio.emit(self.SERVER_PACKET, msgpack.packb((Server.EVENT_IDS[event], data), use_bin_type=True))
         except Exception as e:
-            logging.error(f'[Net-SendData] Fehler: {e}')
+            logger.error('[Net-SendData] Fehler: %s', e)
+
+
+
+class _DiscoverProtocol(asyncio.DatagramProtocol):
+    """Receives server broadcasts on the event loop during discovery."""
+
+    def __init__(self, network):
+        self.network = network
+
+    def datagram_received(self, data, addr):
+        if data.startswith(self.network._BROADCAST_PREFIX) and addr[0] not in self.network._seen_hosts:
+            self.network._seen_hosts.add(addr[0])
+            self.network.broadcast_servers.append({"host": addr[0], "port": data[self.network._PREFIX_LEN:].decode('ascii')})
+        logger.debug("[Net-Discover] Received broadcast from %s", addr)
 
 
 
 class NetworkEventManager:
     """Handles network events by managing listeners and triggering events."""
 
-    def __init__(self):
-        self._listeners = {}
-        logging.debug("[Net-Event] Event Manager initialized")
+    def __init__(self, sio=None):
+        self._sio = sio
+        self._listeners = defaultdict(list)
+        logger.debug("[Net-Event] Event Manager initialized")
 
     def add_listener(self, event_type:str, callback):
         """Adds a listener to a specific event type."""
-        if event_type not in self._listeners:
-            self._listeners[event_type] = []
-        self._listeners[event_type].append(callback)
-        logging.debug(f"[Net-Event] Listener added: {event_type} -> {callback}")
+        listeners = self._listeners[event_type]
+        if not listeners and self._sio is not None:
+            self._sio.on(event_type, functools.partial(self.trigger_event, event_type))
+        listeners.append((asyncio.iscoroutinefunction(callback), callback))
+        logger.debug("[Net-Event] Listener added: %s -> %s", event_type, callback)
 
     async def trigger_event(self, event_type:str, data):
         """Triggers an event and calls all listeners for the event type."""
-        if event_type in self._listeners:
-            logging.debug(f"[Net-Event] Trigger {event_type}")
-            for callback in self._listeners[event_type]:
-                if asyncio.iscoroutinefunction(callback):
+        listeners = self._listeners.get(event_type)
+        if listeners:
+            logger.debug("[Net-Event] Trigger %s", event_type)
+            for is_coro, callback in listeners:
+                if is_coro:
                     await callback(data)
                 else:
                     callback(data)
         else:
-            logging.warning(f"[Net-Event] No listeners for event: {event_type}")
+            logger.warning("[Net-Event] No listeners for event: %s", event_type)
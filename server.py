@@ -1,9 +1,30 @@
+import errno
 import asyncio
 import logging
+import contextlib
+import msgpack
 import socketio
 import uvicorn
 import socket
 
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+
+    class _OrjsonSerializer:
+        """Adapter exposing the dumps/loads interface python-socketio expects."""
+
+        @staticmethod
+        def dumps(obj, *args, **kwargs):
+            return orjson.dumps(obj).decode('utf-8')
+
+        loads = staticmethod(orjson.loads)
+
+    JSON_SERIALIZER = _OrjsonSerializer
+except ImportError:
+    import json as JSON_SERIALIZER
+
 
 
 class Server:
@@ -19,30 +40,41 @@ class Server:
 
     NETWORK_PACKET = "RELAY"            # Event type for network packet relay (client sending data to other client)
     MAX_CLIENTS = 2                     # Maximum number of clients allowed to connect to the server
+    DISCOVER_DEBOUNCE = 0.05            # Window for batching discovery replies in seconds
+    SESSION_ROOM = "session"            # Room holding all clients of the game session
+
+    EVENT_IDS = {"CHAT": 1, "DATA": 2, "TURN": 3, "COIN": 4, "MOVE": 5, "ACK": 6}   # Wire tags for the msgpack relay format
+    EVENT_NAMES = {event_id: event for event, event_id in EVENT_IDS.items()}        # Inverse table for decoding relayed packets
 
 
     def __init__(self, session_name: str, session_port: int):
         """Initialize the server with a session name and port."""
-        self.sio = socketio.AsyncServer(cors_allowed_origins='*', async_mode='asgi')
+        self.sio = socketio.AsyncServer(cors_allowed_origins='*', async_mode='asgi', json=JSON_SERIALIZER)
         self.app = socketio.ASGIApp(self.sio)    
 
         self.session_name = session_name
         self.session_port = session_port
-        self.connected_clients = []
+        self.connected_clients = set()
+        self._peer = {}
+        self._discover_pending = []
+        self._discover_task = None
 
     
     async def broadcast_ip(self):
         """Broadcasts the server's IP address and port using a UDP socket."""
-        message = f"{self.BROADCAST_MESSAGE} {self.session_port}".encode('utf-8')
+        loop = asyncio.get_running_loop()
+        msg_str = f"{self.BROADCAST_MESSAGE} {self.session_port}"
+        msgview = memoryview(msg_str.encode('utf-8'))
+        dest = ('<broadcast>', self.BROADCAST_PORT)
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as sock:
             sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            sock.settimeout(0.2)
+            sock.setblocking(False)
             while True:
                 try:
-                    sock.sendto(message, ('<broadcast>', self.BROADCAST_PORT))
-                    logging.debug(f"[Server-Broadcast] Broadcasting server info: {message.decode('utf-8')}")
+                    await loop.sock_sendto(sock, msgview, dest)
+                    logger.debug("[Server-Broadcast] Broadcasting server info: %s", msg_str)
                 except Exception as e:
-                    logging.error(f"[Server-Broadcast] Error broadcasting server info: {e}")
+                    logger.error("[Server-Broadcast] Error broadcasting server info: %s", e)
                 await asyncio.sleep(self.BROADCAST_INTERVAL)
 
     
@@ -52,77 +84,110 @@ class Server:
         async def connect(sid, environ):
             """Handle a new incomming SocketIO connection."""
             try:
+                if 'mode=probe' in environ.get('QUERY_STRING', ''):
+                    # Discovery probes are not game clients and must not occupy a session slot
+                    logger.debug("[Server-Connect] Probe connected: %s", sid)
+                    return
+
                 if len(self.connected_clients) < self.MAX_CLIENTS:
-                    if self.connected_clients:
-                        await self.sio.emit(self.NETWORK_INFO, f"[Server-Connect] User {sid} connected", to=self.connected_clients[0])
-                    logging.debug(f"[Server-Connect] Successfully connected: {sid}")
-                    self.connected_clients.append(sid)
+                    peer = next(iter(self.connected_clients), None)
+                    if peer is not None:
+                        self._peer[sid] = peer
+                        self._peer[peer] = sid
+                        await self.sio.emit(self.NETWORK_INFO, f"[Server-Connect] User {sid} connected", to=peer)
+                    else:
+                        self._peer[sid] = None
+                    logger.debug("[Server-Connect] Successfully connected: %s", sid)
+                    self.connected_clients.add(sid)
+                    await self.sio.enter_room(sid, self.SESSION_ROOM)
                 else:
                     await self.sio.emit(self.NETWORK_WARNING, "[Server-Connect] Disconnected due to exceeded connections", to=sid)
                     await self.sio.disconnect(sid)
 
             except Exception as e:
-                logging.error(f"[Server-Connect] Error handling connect: {e}")
+                logger.error("[Server-Connect] Error handling connect: %s", e)
 
     
         @self.sio.on('disconnect')
         async def disconnect(sid):
             """Handle a disconnecting SocketIO connection."""
             try:
-                other_client = [client for client in self.connected_clients if client != sid]
-                if other_client:
-                    await self.sio.emit(self.NETWORK_INFO, f"[Server-Disconnect] User {sid} disconnected", to=other_client[0])
-                logging.debug(f"[Server-Disconnect] Successfully disconnected: {sid}")
-                self.connected_clients.remove(sid)
+                peer = self._peer.pop(sid, None)
+                if peer:
+                    self._peer[peer] = None
+                    await self.sio.emit(self.NETWORK_INFO, f"[Server-Disconnect] User {sid} disconnected", to=peer)
+                logger.debug("[Server-Disconnect] Successfully disconnected: %s", sid)
+                self.connected_clients.discard(sid)
 
             except Exception as e:
-                logging.error(f"[Server-Disconnect] Error handling disconnect: {e}")
+                logger.error("[Server-Disconnect] Error handling disconnect: %s", e)
 
 
         @self.sio.on(self.NETWORK_DISCOVER)
         async def discover(sid, data):
             """Handle a network discovery request by a client."""
-            await asyncio.sleep(1)
-            try:
-                if len(self.connected_clients) < self.MAX_CLIENTS + 1:
-                    await self.sio.emit(self.NETWORK_DISCOVER, {"connectable": True, "player_count": len(self.connected_clients), "session_name": self.session_name, "session_host": data, "session_port": self.session_port}, to=sid)
-                    logging.debug(f"[Server-Discover] Discovered by {sid} (success)")
-
-                else:
-                    await self.sio.emit(self.NETWORK_DISCOVER, {"connectable": False}, to=sid)
-                    logging.debug(f"[Server-Discover] Discovered by {sid} (failure)")
-
-            except Exception as e:
-                logging.error(f"[Server-Discover] Error handling disvover: {e}")
+            self._discover_pending.append((sid, data))
+            if self._discover_task is None or self._discover_task.done():
+                self._discover_task = asyncio.create_task(self._flush_discover())
 
 
         @self.sio.on(self.NETWORK_PACKET)
         async def relay(sid, data):
             """Handle the network packet relay to the other client."""
             try:
-                if 'event_type' not in data or 'data' not in data:
-                    await self.sio.emit(self.NETWORK_WARNING, "[Server-Packet] Invalid data format", to=sid)
-                    return
-                
-                logging.info(f"[Net-Packet] Received {data} (from {sid})")
-                other_client = [client for client in self.connected_clients if client != sid]
+                if isinstance(data, dict):
+                    # Legacy JSON envelope, kept for backward compat during rollout
+                    try:
+                        event_type, payload = data["event_type"], data["data"]
+                    except KeyError:
+                        await self.sio.emit(self.NETWORK_WARNING, "[Server-Packet] Invalid data format", to=sid)
+                        return
+                else:
+                    event_id, payload = msgpack.unpackb(data, raw=False)
+                    event_type = self.EVENT_NAMES[event_id]
 
-                if other_client:
-                    await self.sio.emit(data["event_type"], data["data"], to=other_client[0])
+                logger.info("[Net-Packet] Received %s: %s (from %s)", event_type, payload, sid)
+                peer = self._peer.get(sid)
+
+                if peer:
+                    await self.sio.emit(event_type, payload, room=self.SESSION_ROOM, skip_sid=sid)
                 else:
                     await self.sio.emit(self.NETWORK_WARNING, "[Server-Packet] No clients available to send", to=sid)
 
             except Exception as e:
-                logging.error(f"[Server-Packet] Error handling packet relay: {e}")
+                logger.error("[Server-Packet] Error handling packet relay: %s", e)
                 await self.sio.emit(self.NETWORK_WARNING, "[Server-Packet] Error processing your request", to=sid)
 
 
+    async def _flush_discover(self):
+        """Answers all discovery requests queued within one debounce window."""
+        while self._discover_pending:
+            await asyncio.sleep(self.DISCOVER_DEBOUNCE)
+            pending, self._discover_pending = self._discover_pending, []
+            for sid, host in pending:
+                try:
+                    if len(self.connected_clients) < self.MAX_CLIENTS:
+                        await self.sio.emit(self.NETWORK_DISCOVER, {"connectable": True, "player_count": len(self.connected_clients), "session_name": self.session_name, "session_host": host, "session_port": self.session_port}, to=sid)
+                        logger.debug("[Server-Discover] Discovered by %s (success)", sid)
+
+                    else:
+                        await self.sio.emit(self.NETWORK_DISCOVER, {"connectable": False}, to=sid)
+                        logger.debug("[Server-Discover] Discovered by %s (failure)", sid)
+
+                except Exception as e:
+                    logger.error("[Server-Discover] Error handling disvover: %s", e)
+
+
     async def start_server(self):
         """Start the server and listen for incoming connections."""
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            if s.connect_ex(('localhost', self.session_port)) == 0:
-                logging.error(f"[Server-Init] Port {self.session_port} is already in use")
-                return
+            try:
+                s.bind(('', self.session_port))
+            except OSError as e:
+                if e.errno == errno.EADDRINUSE:
+                    logger.error("[Server-Init] Port %s is already in use", self.session_port)
+                    return
+                raise
         
         broadcast_task = asyncio.create_task(self.broadcast_ip())
         self.register_event_handlers()
@@ -130,8 +195,12 @@ class Server:
         config = uvicorn.Config(self.app, host="0.0.0.0", port=self.session_port, log_level="info")
         server = uvicorn.Server(config)
 
-        await server.serve()
-        await broadcast_task()
+        try:
+            await server.serve()
+        finally:
+            broadcast_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await broadcast_task
 
 
 